@@ -1,14 +1,42 @@
 # app.py — ZARI Smart Home Assistant (UI with no engine/IP details)
 
-import os, io, json, socket, tempfile
+import os, io, json, platform, select, socket, struct, threading
 from typing import Optional, Dict, Any
 
+# Pin native thread pools before numpy/ctranslate2 load so they don't
+# oversubscribe the cores the STT engine is using. The engine is shared by
+# every session, so its thread count is a process-level setting (env
+# STT_THREADS) rather than a per-session control.
+def _env_threads(name: str, default: int) -> int:
+    # Anything that isn't a positive integer (unset, "auto", stray
+    # whitespace) falls back to the default instead of failing at import
+    try:
+        value = int((os.getenv(name) or "").strip())
+    except ValueError:
+        return default
+    return value if value > 0 else default
+
+STT_THREADS = _env_threads("STT_THREADS", max(1, (os.cpu_count() or 2) // 2))
+for _var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(_var, str(STT_THREADS))
+
 import streamlit as st
 import numpy as np
 import soundfile as sf
+import soxr
 from pydub import AudioSegment
 from streamlit_mic_recorder import mic_recorder
 
+try:
+    import orjson  # optional: faster bridge payload encoding, emits bytes directly
+except ImportError:
+    orjson = None
+
+try:
+    from numba import njit, prange  # optional: JIT PCM conversion for long uploads
+except ImportError:
+    njit = None
+
 # Internal intent parser (kept generic)
 from command_parser import parse_command
 
@@ -39,28 +67,62 @@ st.set_page_config(page_title="Smart Home Assistant", page_icon="🎙️")
 st.title("🎙️ Smart Home Assistant")
 st.caption("Powered by ZARI")
 
-# Optional: keep a simple simulator state
-if "sim_gpio" not in st.session_state:
-    st.session_state.sim_gpio = {
-        "light:living room": False,
-        "light:kitchen": False,
-        "fan:kitchen": False,
-        "garage:door": "closed",
-        "thermostat:home": 72,
-    }
+# Optional: keep a simple simulator state, laid out as parallel arrays
+# (names/kinds lists + one int value array) so an update is an index write
+SIM_DEFAULTS = (
+    ("light:living room", "switch", 0),
+    ("light:kitchen", "switch", 0),
+    ("fan:kitchen", "switch", 0),
+    ("garage:door", "door", 0),
+    ("thermostat:home", "temp", 72),
+)
+if "sim_values" not in st.session_state:
+    st.session_state.sim_names = [name for name, _, _ in SIM_DEFAULTS]
+    st.session_state.sim_kinds = [kind for _, kind, _ in SIM_DEFAULTS]
+    st.session_state.sim_values = np.array([v for _, _, v in SIM_DEFAULTS], dtype=np.int64)
+    st.session_state.sim_idx = {name: i for i, name in enumerate(st.session_state.sim_names)}
 
 # -----------------------------
 # Sidebar (minimal, no engine details)
 # -----------------------------
 st.sidebar.header("Settings")
-lang_choice = st.sidebar.selectbox("Language", ["auto", "en", "es"], index=0)
+# Default to an explicit language: "auto" costs an extra detection pass
+lang_choice = st.sidebar.selectbox("Language", ["auto", "en", "es"], index=1)
 st.sidebar.write("Mode:", "SIMULATOR" if SIMULATOR_MODE else "HARDWARE")
+st.sidebar.write("CPU threads:", STT_THREADS)
+
+def _cpu_flags() -> set:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
 
-# Cache the internal STT engine without surfacing details
+def _pick_compute_type() -> str:
+    # int8 pays off where the CPU has int8 dot-product kernels (VNNI/AVX2 on
+    # x86, NEON on arm64); elsewhere let the engine choose what it supports
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "int8"
+    flags = _cpu_flags()
+    if not flags or flags & {"avx512_vnni", "avx_vnni", "avx2"}:
+        return "int8"
+    return "auto"
+
+# One engine per process, shared by all sessions (module globals don't
+# survive Streamlit reruns)
 @st.cache_resource(show_spinner=False)
 def _load_stt():
     # Sensible defaults for CPU; hidden from UI
-    return STTEngine("tiny", compute_type="int8")
+    engine = STTEngine("tiny", compute_type=_pick_compute_type(), cpu_threads=STT_THREADS, num_workers=1)
+    # Warm-up pass on a short silent clip so the first real request
+    # doesn't pay for lazy allocations inside the engine
+    segments, _ = engine.transcribe(np.zeros(8000, dtype=np.float32), language="en")
+    for _ in segments:
+        pass
+    return engine
 
 stt = _load_stt()
 
@@ -68,20 +130,162 @@ stt = _load_stt()
 # -----------------------------
 # Helpers
 # -----------------------------
-def _to_wav_16k_mono_bytes(blob: bytes) -> bytes:
-    seg = AudioSegment.from_file(io.BytesIO(blob))
-    seg = seg.set_channels(1).set_frame_rate(16000)
-    samples = np.array(seg.get_array_of_samples()).astype(np.int16)
-    out = io.BytesIO()
-    sf.write(out, samples, 16000, subtype="PCM_16", format="WAV")
-    return out.getvalue()
-
-def _transcribe(wav_path: str, lang_hint: Optional[str]) -> str:
+def _wav_16k_mono_pcm16_data(blob: bytes) -> Optional[memoryview]:
+    # Walk the RIFF chunks (headers aren't always 44 bytes); returns the
+    # "data" payload only when "fmt " says 16 kHz mono PCM16
+    if len(blob) < 12 or blob[:4] != b"RIFF" or blob[8:12] != b"WAVE":
+        return None
+    conformant = False
+    pos = 12
+    while pos + 8 <= len(blob):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", blob, pos)
+        if chunk_id == b"fmt ":
+            if chunk_size < 16 or pos + 24 > len(blob):
+                return None
+            fmt_tag, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", blob, pos + 8)
+            conformant = (fmt_tag, channels, rate, bits) == (1, 1, 16000, 16)
+            if not conformant:
+                return None
+        elif chunk_id == b"data":
+            if not conformant:
+                return None
+            size = len(blob) - pos - 8
+            if chunk_size not in (0, 0xFFFFFFFF):
+                # 0 / 0xFFFFFFFF are placeholders from streaming writers
+                # that couldn't seek back: the data runs to end of blob
+                size = min(chunk_size, size)
+            size &= ~1
+            return memoryview(blob)[pos + 8:pos + 8 + size]
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+# Below this many samples the plain numpy path wins over kernel dispatch
+_JIT_MIN_SAMPLES = 16000 * 30
+
+@st.cache_resource(show_spinner=False)
+def _load_pcm_kernel():
+    if njit is None:
+        return None
+
+    @njit(parallel=True, fastmath=True)
+    def _i16_to_f32(src, dst):
+        for i in prange(src.size):
+            dst[i] = src[i] * (1.0 / 32768.0)
+
+    # Compile once up front rather than on the first long upload. Real input
+    # is np.frombuffer over bytes, which is read-only and gets its own
+    # specialization, so warm up with the same kind of array.
+    _i16_to_f32(np.frombuffer(bytes(32), dtype=np.int16), np.empty(16, dtype=np.float32))
+    return _i16_to_f32
+
+pcm_kernel = _load_pcm_kernel()
+
+def _pcm16_to_f32(buf) -> np.ndarray:
+    src = np.frombuffer(buf, dtype=np.int16)
+    if pcm_kernel is not None and src.size >= _JIT_MIN_SAMPLES:
+        out = np.empty(src.size, dtype=np.float32)
+        pcm_kernel(src, out)
+        return out
+    # Zero-copy int16 view -> one float32 buffer, scaled in place
+    samples = src.astype(np.float32)
+    samples *= 1.0 / 32768.0
+    return samples
+
+def _to_pcm_16k_mono(blob: bytes) -> np.ndarray:
+    # Already in the target format (typical for mic capture): skip the decoder
+    data = _wav_16k_mono_pcm16_data(blob)
+    if data is not None:
+        return _pcm16_to_f32(data)
+    # Formats libsndfile reads (WAV/FLAC/OGG/MP3) decode in-process
+    try:
+        frames, rate = sf.read(io.BytesIO(blob), dtype="float32", always_2d=True)
+    except sf.LibsndfileError:
+        # Anything else (e.g. m4a) goes through ffmpeg
+        seg = AudioSegment.from_file(io.BytesIO(blob))
+        seg = seg.set_channels(1).set_frame_rate(16000).set_sample_width(2)
+        return _pcm16_to_f32(seg.raw_data)
+    mono = frames[:, 0] if frames.shape[1] == 1 else frames.mean(axis=1, dtype=np.float32)
+    if rate != 16000:
+        mono = soxr.resample(mono, rate, 16000, quality="QQ")
+    return np.ascontiguousarray(mono, dtype=np.float32)
+
+def _transcribe(samples: np.ndarray, lang_hint: Optional[str], on_text=None) -> str:
+    # Short commands only need the 1-best greedy hypothesis (no temperature
+    # fallback), no timestamps and no conditioning on earlier text; VAD
+    # drops leading/trailing silence
     segments, info = stt.transcribe(
-        wav_path,
-        language=None if (lang_hint in (None, "", "auto")) else lang_hint
+        samples,
+        language=None if (lang_hint in (None, "", "auto")) else lang_hint,
+        beam_size=1,
+        best_of=1,
+        temperature=0.0,
+        no_speech_threshold=0.5,
+        condition_on_previous_text=False,
+        without_timestamps=True,
+        vad_filter=True,
+        vad_parameters=dict(min_silence_duration_ms=300),
     )
-    return "".join([s.text for s in segments]).strip()
+    if on_text is None:
+        return "".join(s.text for s in segments).strip()
+    # Segments are decoded lazily; show partial text as each one lands
+    parts = []
+    for s in segments:
+        parts.append(s.text)
+        on_text("".join(parts).strip())
+    return "".join(parts).strip()
+
+# Persistent connection to the local controller, shared across reruns
+@st.cache_resource(show_spinner=False)
+def _bridge_slot() -> Dict[str, Any]:
+    return {"sock": None, "lock": threading.Lock()}
+
+def _is_dead(sock: socket.socket) -> bool:
+    # Readable with nothing to read means the peer closed the connection
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except OSError:
+        return True
+
+def _send_to_bridge(data: bytes) -> None:
+    slot = _bridge_slot()
+    with slot["lock"]:
+        for attempt in range(2):
+            sock = slot["sock"]
+            if sock is None or _is_dead(sock):
+                if sock is not None:
+                    sock.close()
+                slot["sock"] = None
+                sock = socket.create_connection((BRIDGE_HOST, BRIDGE_PORT), timeout=3)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                slot["sock"] = sock
+            try:
+                sock.sendall(data)
+                return
+            except OSError:
+                # Stale connection: drop it and reconnect once
+                sock.close()
+                slot["sock"] = None
+                if attempt:
+                    raise
+
+def _sim_set(name: str, kind: str, value: int) -> None:
+    ss = st.session_state
+    i = ss.sim_idx.get(name)
+    if i is None:
+        # First command for this device/location pair
+        i = ss.sim_idx[name] = len(ss.sim_names)
+        ss.sim_names.append(name)
+        ss.sim_kinds.append(kind)
+        ss.sim_values = np.append(ss.sim_values, 0)
+    ss.sim_values[i] = value
+
+def _sim_display(kind: str, value: int) -> str:
+    if kind == "switch":
+        return "ON" if value else "OFF"
+    if kind == "door":
+        return "open" if value else "closed"
+    return f"{int(value)}°"
 
 def _summarize_intent(intent: Dict[str, Any]) -> str:
     d = intent.get("device") or "device"
@@ -137,20 +341,17 @@ if run:
 
     with st.spinner("Working…"):
         try:
-            wav_norm = _to_wav_16k_mono_bytes(audio_bytes)
+            samples = _to_pcm_16k_mono(audio_bytes)
         except Exception as e:
             st.error(f"Audio error: {e}")
             st.stop()
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmpf:
-            tmpf.write(wav_norm)
-            wav_path = tmpf.name
-
-        transcript = _transcribe(wav_path, lang_choice)
+        st.write("**Heard**")
+        heard = st.empty()
+        transcript = _transcribe(samples, lang_choice, on_text=heard.code)
         intent = parse_command(transcript)
 
-    st.write("**Heard**")
-    st.code(transcript or "(empty)")
+    heard.code(transcript or "(empty)")
 
     st.write("**Action**")
     st.success(_summarize_intent(intent))
@@ -163,19 +364,30 @@ if run:
         val = intent.get("value")
 
         if dev in ("light", "fan") and act in ("on", "off"):
-            st.session_state.sim_gpio[f"{dev}:{loc}"] = (act == "on")
+            _sim_set(f"{dev}:{loc}", "switch", int(act == "on"))
         elif dev == "thermostat" and isinstance(val, (int, float)):
-            st.session_state.sim_gpio["thermostat:home"] = int(val)
+            # parse_command clamps setpoints, so this always fits the int64 array
+            _sim_set("thermostat:home", "temp", int(val))
         elif dev == "garage" and act in ("open", "close"):
-            st.session_state.sim_gpio["garage:door"] = "open" if act == "open" else "closed"
+            _sim_set("garage:door", "door", int(act == "open"))
 
         st.write("**Home status**")
-        st.json(st.session_state.sim_gpio)
+        st.dataframe(
+            {
+                "device": st.session_state.sim_names,
+                "state": [_sim_display(k, v) for k, v in zip(st.session_state.sim_kinds, st.session_state.sim_values)],
+            },
+            hide_index=True,
+            use_container_width=True,
+        )
     else:
         try:
-            payload = json.dumps(intent).encode("utf-8")
-            with socket.create_connection((BRIDGE_HOST, BRIDGE_PORT), timeout=3) as s:
-                s.sendall(payload + b"\n")
+            try:
+                payload = orjson.dumps(intent) if orjson else json.dumps(intent).encode("utf-8")
+            except TypeError:
+                # orjson.JSONEncodeError (a TypeError) on ints past 64 bits
+                payload = json.dumps(intent).encode("utf-8")
+            _send_to_bridge(payload + b"\n")
             st.success("Sent to local controller.")
         except Exception as e:
             st.error(f"Controller unreachable: {e}")
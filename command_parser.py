@@ -1,5 +1,11 @@
+import functools
 import re
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    import ahocorasick  # pyahocorasick (optional): one-pass keyword scan
+except ImportError:
+    ahocorasick = None
 
 LOCATIONS_EN = ["living room","kitchen","bedroom","garage","office","hallway","bathroom"]
 LOCATIONS_ES = ["sala","cocina","dormitorio","garaje","oficina","pasillo","baño","bano"]
@@ -14,45 +20,105 @@ DEVICE_SYNONYMS = {
     "garaje":"garage","puerta del garaje":"garage","puerta":"garage",
 }
 
+# Order is match priority. Phrases and Spanish verbs sit right after the
+# canonical word they mean, so they rank exactly like it.
 ACTION_SYNONYMS = {
-    "on":"on","off":"off","open":"open","close":"close","set":"set",
+    "on":"on","turn on":"on","switch on":"on","encender":"on","prender":"on",
+    "off":"off","turn off":"off","switch off":"off","apagar":"off",
+    "open":"open","abrir":"open","close":"close","cerrar":"close",
+    "set":"set","ajustar":"set","poner":"set",
     "up":"open","down":"close","start":"on","stop":"off",
-    "turn on":"on","turn off":"off","switch on":"on","switch off":"off",
-    "encender":"on","prender":"on","apagar":"off",
-    "abrir":"open","cerrar":"close","subir":"open","bajar":"close","ajustar":"set","poner":"set"
+    "subir":"open","bajar":"close"
 }
 
+# Every accepted location spelling, in match-priority order
+_ALL_LOCATIONS = tuple(LOCATIONS_EN) + tuple(LOCATIONS_ES) + tuple(LOCATION_ALIASES)
+
+# Every accepted spelling -> canonical English location
+_LOC_CANON = {loc: loc for loc in LOCATIONS_EN}
+_LOC_CANON.update({"sala":"living room","cocina":"kitchen","dormitorio":"bedroom","garaje":"garage",
+                   "oficina":"office","pasillo":"hallway","baño":"bathroom","bano":"bathroom"})
+_LOC_CANON.update(LOCATION_ALIASES)
+
 def _normalize_location(text: str) -> Optional[str]:
-    t = text.strip().lower()
-    if t in LOCATION_ALIASES: t = LOCATION_ALIASES[t]
-    if t in LOCATIONS_EN: return t
-    if t in LOCATIONS_ES:
-        mapping = {"sala":"living room","cocina":"kitchen","dormitorio":"bedroom","garaje":"garage",
-                   "oficina":"office","pasillo":"hallway","baño":"bathroom","bano":"bathroom"}
-        return mapping[t]
-    return None
+    return _LOC_CANON.get(text.strip().lower())
+
+_find_number = re.compile(r"-?\d+(?:\.\d+)?").search
 
 def _extract_number(text: str) -> Optional[float]:
-    m = re.search(r"(-?\d+(\.\d+)?)", text)
-    return float(m.group(1)) if m else None
+    m = _find_number(text)
+    return float(m[0]) if m else None
 
-def parse_command(transcript: str) -> Dict[str, Any]:
-    t = (transcript or "").strip().lower()
-    if not t:
-        return {"intent":"none","action":None,"device":None,"location":None,"value":None,"raw":transcript}
+# Keyword tables as keyword -> (rank, canonical). The lowest-ranked hit
+# wins, preserving the tables' first-in-order priority. Without
+# pyahocorasick each table is matched as one word-bounded alternation
+# (longest keyword first).
+def _alternation(ranked: Dict[str, Tuple[int, Optional[str]]]):
+    return re.compile(r"\b(" + "|".join(re.escape(k) for k in sorted(ranked, key=len, reverse=True)) + r")\b")
+
+def _ranked(pairs) -> Dict[str, Tuple[int, Optional[str]]]:
+    return {k: (i, v) for i, (k, v) in enumerate(pairs)}
+
+_DEVICE_RANK = _ranked(DEVICE_SYNONYMS.items())
+_ACTION_RANK = _ranked(ACTION_SYNONYMS.items())
+_LOCATION_RANK = _ranked((loc, _normalize_location(loc)) for loc in _ALL_LOCATIONS)
+
+def _best_match(pattern, ranked, t: str) -> Optional[str]:
+    hit = min(pattern.findall(t), key=ranked.__getitem__, default=None)
+    return ranked[hit][1] if hit else None
 
-    for k,v in {"turn on":"on","turn off":"off","switch on":"on","switch off":"off",
-                "encender":"on","prender":"on","apagar":"off","abrir":"open","cerrar":"close",
-                "ajustar":"set","poner":"set"}.items():
-        t = t.replace(k, v)
+def _build_automaton():
+    # keyword -> (length, [(kind, rank, canonical), ...]); a keyword such
+    # as "garage" can be both a device and a location
+    hits = {}
+    for kind, ranked in (("device", _DEVICE_RANK), ("action", _ACTION_RANK), ("location", _LOCATION_RANK)):
+        for k, (rank, v) in ranked.items():
+            hits.setdefault(k, []).append((kind, rank, v))
+    automaton = ahocorasick.Automaton()
+    for k, v in hits.items():
+        automaton.add_word(k, (len(k), v))
+    automaton.make_automaton()
+    return automaton
 
-    device = next((v for k,v in DEVICE_SYNONYMS.items() if re.search(rf"\b{re.escape(k)}\b", t)), None)
-    action = next((v for k,v in ACTION_SYNONYMS.items() if re.search(rf"\b{re.escape(k)}\b", t)), None)
+@functools.cache
+def _get_matchers():
+    # Built on first parse rather than at import, so importing this module
+    # (e.g. for its tables) stays cheap
+    automaton = _build_automaton() if ahocorasick else None
+    return automaton, _alternation(_DEVICE_RANK), _alternation(_ACTION_RANK), _alternation(_LOCATION_RANK)
 
-    location = None
-    for loc in LOCATIONS_EN + LOCATIONS_ES + list(LOCATION_ALIASES.keys()):
-        if re.search(rf"\b{re.escape(loc)}\b", t):
-            location = _normalize_location(loc); break
+def _is_word_char(c: str) -> bool:
+    # same character class as \w for str patterns
+    return c.isalnum() or c == "_"
+
+def _scan_keywords(t: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    automaton, device_re, action_re, location_re = _get_matchers()
+    if automaton is not None:
+        best = {}
+        for end, (length, hits) in automaton.iter(t):
+            start = end - length + 1
+            if (start > 0 and _is_word_char(t[start - 1])) or (end + 1 < len(t) and _is_word_char(t[end + 1])):
+                continue
+            for kind, rank, canonical in hits:
+                if kind not in best or rank < best[kind][0]: best[kind] = (rank, canonical)
+        return tuple(best[k][1] if k in best else None for k in ("device", "action", "location"))
+
+    return (_best_match(device_re, _DEVICE_RANK, t), _best_match(action_re, _ACTION_RANK, t),
+            _best_match(location_re, _LOCATION_RANK, t))
+
+_INTENT_KEYS = ("intent","action","device","location","value")
+
+# Thermostat setpoints are clamped once here, so the UI, simulator and
+# bridge all see the same number (and it always fits a 64-bit int)
+THERMOSTAT_MIN, THERMOSTAT_MAX = -100, 200
+
+@functools.lru_cache(maxsize=1024)
+def _parse_norm(t: str) -> Tuple:
+    # t is already stripped/lowercased; returns values in _INTENT_KEYS order
+    if not t:
+        return ("none", None, None, None, None)
+
+    device, action, location = _scan_keywords(t)
 
     value = None
     if device == "thermostat" or (action == "set" and device):
@@ -64,6 +130,13 @@ def parse_command(transcript: str) -> Dict[str, Any]:
         elif action in ("open","close"): device = "garage"
     if device == "light" and location is None: location = "living room"
     if device == "thermostat" and action is None: action = "set"
+    if device == "thermostat" and value is not None: value = min(max(value, THERMOSTAT_MIN), THERMOSTAT_MAX)
 
-    return {"intent":"device_control" if device else "unknown",
-            "action":action,"device":device,"location":location,"value":value,"raw":transcript}
+    return ("device_control" if device else "unknown", action, device, location, value)
+
+def parse_command(transcript: str) -> Dict[str, Any]:
+    # Streamlit reruns the script on every interaction; identical transcripts
+    # are served from the cache
+    intent = dict(zip(_INTENT_KEYS, _parse_norm((transcript or "").strip().lower())))
+    intent["raw"] = transcript
+    return intent
@@ -6,14 +6,24 @@ Usage:
   (Windows example: --serial-port COM3)
 """
 import argparse
+import functools
 import json
+import queue
+import selectors
 import socket
 import threading
-import sys
 import time
+import sys
 
 import serial  # pyserial
 
+from command_parser import LOCATIONS_EN
+
+try:
+    from orjson import loads as json_loads  # optional: faster, parses bytes directly
+except ImportError:
+    from json import loads as json_loads
+
 
 def parse_args():
     p = argparse.ArgumentParser()
@@ -24,56 +34,195 @@ def parse_args():
     return p.parse_args()
 
 
-def to_arduino_line(cmd: dict) -> str:
-    device = cmd.get("device")
-    action = cmd.get("action")
-    location = (cmd.get("location") or "home").replace(" ", "_")
-    value = cmd.get("value")
-
-    if device in ("light", "fan"):
-        state = "ON" if action == "on" else "OFF"
-        return f"{device.upper()}:{location}:{state}\n"
-    if device == "thermostat" and isinstance(value, int):
-        return f"THERMOSTAT:{location}:{value}\n"
-    if device == "garage":
-        state = "OPEN" if action == "open" else "CLOSE"
-        return f"GARAGE:{location}:{state}\n"
-
-    return f"UNKNOWN:{device}:{action}:{location}:{value}\n"
-
-
-def client_thread(conn, ser):
-    with conn:
-        data = conn.recv(4096)
-        if not data:
-            return
-        # Support newline-delimited JSON
-        for line in data.splitlines():
-            try:
-                obj = json.loads(line.decode("utf-8"))
-            except Exception:
+def _build_onoff(device, action, location, value) -> bytes:
+    state = "ON" if action == "on" else "OFF"
+    return f"{device.upper()}:{location}:{state}\n".encode("utf-8")
+
+
+def _build_thermostat(device, action, location, value) -> bytes:
+    if isinstance(value, int):
+        return f"THERMOSTAT:{location}:{value}\n".encode("utf-8")
+    return _build_unknown(device, action, location, value)
+
+
+def _build_garage(device, action, location, value) -> bytes:
+    state = "OPEN" if action == "open" else "CLOSE"
+    return f"GARAGE:{location}:{state}\n".encode("utf-8")
+
+
+def _build_unknown(device, action, location, value) -> bytes:
+    return f"UNKNOWN:{device}:{action}:{location}:{value}\n".encode("utf-8")
+
+
+_BUILDERS = {
+    "light": _build_onoff,
+    "fan": _build_onoff,
+    "thermostat": _build_thermostat,
+    "garage": _build_garage,
+}
+
+
+# Lines for every switch/garage command at a known location, built once;
+# only thermostat values and unseen locations are formatted on demand
+_LINES = {
+    (device, action, location): _BUILDERS[device](device, action, location, None)
+    for location in [loc.replace(" ", "_") for loc in LOCATIONS_EN] + ["home"]
+    for device, actions in (("light", ("on", "off")), ("fan", ("on", "off")), ("garage", ("open", "close")))
+    for action in actions
+}
+
+
+# typed=True keeps e.g. value 1 and True apart (they format differently)
+@functools.lru_cache(maxsize=256, typed=True)
+def _line_for(device, action, location, value) -> bytes:
+    return _BUILDERS.get(device, _build_unknown)(device, action, location, value)
+
+
+def to_arduino_line(cmd: dict) -> bytes:
+    fields = (
+        cmd.get("device"),
+        cmd.get("action"),
+        (cmd.get("location") or "home").replace(" ", "_"),
+        cmd.get("value"),
+    )
+    try:
+        line = _LINES.get(fields[:3])
+        return line if line is not None else _line_for(*fields)
+    except TypeError:
+        # Unhashable field (e.g. a list in a malformed payload): skip the cache
+        builder = _BUILDERS.get(fields[0], _build_unknown) if isinstance(fields[0], str) else _build_unknown
+        return builder(*fields)
+
+
+def _lines_to_serial(lines) -> bytearray:
+    out = bytearray()
+    for line in lines:
+        # A bad line from one client is skipped, never allowed to take down
+        # the shared connection loop
+        try:
+            obj = json_loads(line)
+            if not isinstance(obj, dict):
                 continue
-            msg = to_arduino_line(obj)
-            ser.write(msg.encode("utf-8"))
-            ser.flush()
-            # Small delay to avoid flooding
-            time.sleep(0.05)
+            if isinstance(obj.get("value"), float) and json_loads is not json.loads:
+                # orjson reads integers past 64 bits as floats; stdlib json
+                # keeps them exact, as the Arduino line format expects
+                obj = json.loads(line)
+            out += to_arduino_line(obj)
+        except Exception:
+            continue
+    return out
+
+
+# The sketch's serial RX buffer holds 64 bytes and it answers every line
+# with a longer log line, so a burst written back to back overruns it.
+# Writes go out in slices of whole lines that fit the buffer, at least
+# SLICE_GAP_S apart (the old per-line delay).
+ARDUINO_RX_BYTES = 64
+SLICE_GAP_S = 0.05
+
+
+def _rx_slices(out):
+    piece = bytearray()
+    for line in out.splitlines(keepends=True):
+        if piece and len(piece) + len(line) > ARDUINO_RX_BYTES:
+            yield piece
+            piece = bytearray()
+        piece += line
+    if piece:
+        yield piece
+
+
+def writer_thread(ser, out_q):
+    # Sole owner of the serial port: the connection loop only enqueues bytes, and
+    # everything queued since the last write is coalesced before slicing
+    next_write = 0.0
+    while True:
+        out = bytearray(out_q.get())
+        try:
+            while True:
+                out += out_q.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            for piece in _rx_slices(out):
+                wait = next_write - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                ser.write(piece)
+                ser.flush()
+                next_write = time.monotonic() + SLICE_GAP_S
+        except serial.SerialException as e:
+            print(f"[bridge] Serial write failed: {e}")
+
+
+# Longest partial line kept per client before the connection is dropped
+MAX_LINE_BYTES = 4096
+
+
+def serve(srv, out_q):
+    # One thread serves all connections: each client keeps a carry buffer
+    # for a partial line, and the complete newline-delimited JSON lines from
+    # one recv are queued for the serial writer as a single batch. When the
+    # writer falls behind and the queue is full, out_q.put blocks this loop
+    # and with it every client, which is the intended backpressure.
+    sel = selectors.DefaultSelector()
+    srv.setblocking(False)
+    sel.register(srv, selectors.EVENT_READ)
+    pending = {}
+    try:
+        while True:
+            for key, _ in sel.select():
+                sock = key.fileobj
+                if sock is srv:
+                    try:
+                        conn, addr = srv.accept()
+                    except BlockingIOError:
+                        continue
+                    print(f"[bridge] Client from {addr}")
+                    conn.setblocking(False)
+                    sel.register(conn, selectors.EVENT_READ)
+                    pending[conn] = b""
+                    continue
+
+                try:
+                    data = sock.recv(65536)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b""  # reset by peer: treat as EOF
+                if data:
+                    *lines, pending[sock] = (pending[sock] + data).split(b"\n")
+                    if len(pending[sock]) > MAX_LINE_BYTES:
+                        print(f"[bridge] Dropping client: line over {MAX_LINE_BYTES} bytes")
+                        del pending[sock]
+                        sel.unregister(sock)
+                        sock.close()
+                else:
+                    lines = [pending.pop(sock)]  # unterminated last line before EOF
+                    sel.unregister(sock)
+                    sock.close()
+                out = _lines_to_serial(lines)
+                if out:
+                    out_q.put(bytes(out))
+    finally:
+        for sock in pending:
+            sock.close()
+        sel.close()
 
 
 def main():
     args = parse_args()
     print(f"[bridge] Opening serial {args.serial_port} @ {args.baud}")
     with serial.Serial(args.serial_port, args.baud, timeout=1) as ser:
+        out_q = queue.Queue(maxsize=1024)
+        threading.Thread(target=writer_thread, args=(ser, out_q), daemon=True).start()
         srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         srv.bind((args.host, args.port))
         srv.listen(5)
         print(f"[bridge] Listening on {args.host}:{args.port}")
         try:
-            while True:
-                conn, addr = srv.accept()
-                print(f"[bridge] Client from {addr}")
-                threading.Thread(target=client_thread, args=(conn, ser), daemon=True).start()
+            serve(srv, out_q)
         except KeyboardInterrupt:
             print("\n[bridge] Exiting.")
         finally: